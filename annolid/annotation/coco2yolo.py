@@ -2,17 +2,30 @@ import os
 import json
 from pathlib import Path
 import shutil
+import numpy as np
+from collections import defaultdict
+from operator import itemgetter
+
+# look up all the needed fields of a COCO record in one call
+_image_fields = itemgetter("file_name", "width", "height", "id")
+_annotation_fields = itemgetter("category_id", "bbox")
 
 
 def xywh2cxcywh(box, img_size):
+    """
+    Convert COCO boxes [x, y, w, h] in pixels to YOLO boxes
+    [cx, cy, w, h] normalized by the image size.
+    `box` can be a single box or an array of boxes with shape (N, 4).
+    """
+    box = np.asarray(box, dtype=np.float64)
     dw = 1. / img_size[0]
     dh = 1. / img_size[1]
 
-    x = box[0] + box[2] / 2.0
-    y = box[1] + box[3] / 2.0
+    x = box[..., 0] + box[..., 2] / 2.0
+    y = box[..., 1] + box[..., 3] / 2.0
 
-    w = box[2]
-    h = box[3]
+    w = box[..., 2]
+    h = box[..., 3]
 
     x = x * dw
     w = w * dw
@@ -39,23 +52,28 @@ def create_dataset(json_file='annotation.json',
 
     img_file_path = Path(json_file).parent
 
-    for img in data['images']:
-        file_name = img["file_name"]
-        img_width = img["width"]
-        img_height = img["height"]
+    # group the annotations by image once
+    # instead of scanning all of them for every image
+    image_annotations = defaultdict(list)
+    for ann in data['annotations']:
+        image_annotations[ann["image_id"]].append(ann)
 
-        img_id = img["id"]
+    for img in data['images']:
+        file_name, img_width, img_height, img_id = _image_fields(img)
 
         file_name = file_name.replace("\\", "/")
         shutil.copy(img_file_path / file_name, images_path)
         anno_txt_name = os.path.basename(file_name).split(".")[0] + ".txt"
         anno_txt_flie = labels_path / anno_txt_name
+        anns = image_annotations.get(img_id, [])
         with open(anno_txt_flie, 'w') as atf:
-            for ann in data['annotations']:
-                if ann["image_id"] == img_id:
-                    box = xywh2cxcywh(ann["bbox"], (img_width, img_height))
-                    atf.write("%s %s %s %s %s\n" % (ann["category_id"], box[0],
-                                                    box[1], box[2], box[3]))
+            if anns:
+                category_ids, bboxes = zip(*map(_annotation_fields, anns))
+                boxes = xywh2cxcywh(bboxes, (img_width, img_height))
+                for category_id, x, y, w, h in zip(category_ids,
+                                                   *(b.tolist() for b in boxes)):
+                    atf.write("%s %s %s %s %s\n" % (category_id, x,
+                                                    y, w, h))
 
     for c in data["categories"]:
         # exclude backgroud with id 0
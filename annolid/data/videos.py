@@ -5,10 +5,197 @@ import cv2
 import argparse
 import numpy as np
 import random
+import queue
+import threading
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append("detector/yolov5/")
 
+# extracted frames are used for labeling and training,
+# keep OpenCV's default JPEG quality of 95
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 95]
+
+
+def _create_background_subtractor():
+    """
+    Create a MOG2 background subtractor with shadow detection disabled.
+    The CUDA implementation is used when a CUDA device is available.
+
+    Returns
+    -------
+    apply: callable, takes a frame and an optional output buffer
+           and returns the 1-channel foreground mask
+    """
+    if (hasattr(cv2, 'cuda')
+            and cv2.cuda.getCudaEnabledDeviceCount() > 0):
+        subtractor = cv2.cuda.createBackgroundSubtractorMOG2(
+            detectShadows=False)
+        stream = cv2.cuda.Stream_Null()
+        gpu_frame = cv2.cuda_GpuMat()
+
+        def apply(frame, fgmask=None):
+            gpu_frame.upload(frame)
+            gpu_mask = subtractor.apply(gpu_frame, -1, stream)
+            if fgmask is None:
+                return gpu_mask.download()
+            return gpu_mask.download(fgmask)
+        return apply
+
+    subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+    return subtractor.apply
+
+
+def _load_frames(video_file, frame_numbers, batch_size=8):
+    """
+    Decode the frames with the given sorted frame numbers.
+    Frame numbers past the end of the video are skipped.
+    Seeks with the video_reader (FFmpeg) batch decoder when it is installed,
+    otherwise reads the video with OpenCV up to the last wanted frame,
+    skipping the color conversion of the unwanted frames.
+    The batch decoder is called on `batch_size` frames at a time
+    so that only a few decoded frames are held in memory.
+
+    Yields
+    ------
+    frame_number: int
+    frame: ndarray, shape(n_rows, n_cols, 3), BGR
+    """
+    try:
+        from video_reader import PyVideoReader
+    except ImportError:
+        PyVideoReader = None
+
+    frame_numbers = list(frame_numbers)
+    if not frame_numbers:
+        return
+
+    if PyVideoReader is not None:
+        vr = PyVideoReader(video_file, threads=os.cpu_count())
+        # the frame count reported by the container can be too large,
+        # skip the frame numbers past the decodable frames
+        frame_numbers = [f for f in frame_numbers if f < len(vr)]
+        for start in range(0, len(frame_numbers), batch_size):
+            batch = frame_numbers[start:start + batch_size]
+            for frame_number, frame in zip(batch, vr.get_batch(batch)):
+                yield frame_number, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        return
+
+    cap = cv2.VideoCapture(video_file)
+    wanted = set(frame_numbers)
+    for frame_number in range(frame_numbers[-1] + 1):
+        if not cap.grab():
+            break
+        if frame_number in wanted:
+            ret, frame = cap.retrieve()
+            if ret:
+                yield frame_number, frame
+    cap.release()
+
+
+def _read_frames(cap, maxsize=4):
+    """
+    Read the remaining frames of the capture in a background thread
+    so that decoding the next frames overlaps with processing
+    the current one.
+
+    Parameters
+    ----------
+    cap: cv2.VideoCapture, opened video capture
+    maxsize: int, max number of decoded frames waiting to be processed
+
+    An exception raised while decoding is re-raised in the caller.
+
+    Yields
+    ------
+    frame_number: int
+    frame: ndarray, shape(n_rows, n_cols, 3)
+    """
+    frames = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def decode():
+        try:
+            while not stop.is_set():
+                frame_number = int(cap.get(1))
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                put((frame_number, frame))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # always end the stream so that the consumer never blocks
+            put(None)
+
+    decoder = threading.Thread(target=decode, daemon=True)
+    decoder.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                if errors:
+                    raise errors[0]
+                break
+            yield item
+    finally:
+        # also stops the decoder when the caller breaks out early
+        stop.set()
+        decoder.join()
+
+
+def _render_flow_hsv(flow, hsv):
+    """
+    Render a dense optical flow field as a BGR image.
+    The hue encodes the flow direction and the value its magnitude.
+
+    Parameters
+    ----------
+    flow: ndarray, shape(n_rows, n_cols, 2)
+    hsv: ndarray, shape(n_rows, n_cols, 3), uint8 buffer
+         with the saturation channel set to 255
+
+    Returns
+    -------
+    rgb: ndarray, shape(n_rows, n_cols, 3), BGR flow image
+    """
+    mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+    hsv[..., 0] = ang*180/np.pi/2
+    hsv[..., 2] = cv2.normalize(
+        mag, None, 0, 255, cv2.NORM_MINMAX)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def _submit_write(pool, pending, filename, image, max_pending):
+    """
+    Write the image from the thread pool.
+    Waits for the oldest write first when `max_pending` writes
+    are in flight, so at most that many frames are held in memory.
+    """
+    while len(pending) >= max_pending:
+        _wait_write(pending.popleft())
+    pending.append((filename,
+                    pool.submit(cv2.imwrite, filename, image, JPEG_PARAMS)))
+
+
+def _wait_write(write):
+    """
+    Wait for a write submitted by `_submit_write`
+    and raise an IOError if the image was not written.
+    """
+    filename, future = write
+    if not future.result():
+        raise IOError(f"Failed to write the image {filename}")
+
 
 def extract_frames(video_file='None',
                    num_frames=100,
@@ -19,8 +206,12 @@ def extract_frames(video_file='None',
                    ):
     """
     Extract frames from the given video file. 
-    This function saves the wanted number of frames based on
-    optical flow by default.
+    This function saves the wanted number of frames with the most motion
+    by default (`algo` = 'flow'). Motion is scored as the number of
+    foreground pixels found by a MOG2 background subtractor on quarter scale
+    grayscale frames. Dense optical flow is only computed to display it
+    when `show_flow` is True.
+    With `algo` = 'uniform' the frames are selected randomly.
     Or you can save all the frames by providing `num_frames` = -1. 
 
     """
@@ -39,7 +230,7 @@ def extract_frames(video_file='None',
 
     current_frame_number = int(cap.get(1))
 
-    subtractor = cv2.createBackgroundSubtractorMOG2()
+    subtractor = _create_background_subtractor()
     keeped_frames = []
 
     width = cap.get(3)
@@ -49,7 +240,7 @@ def extract_frames(video_file='None',
     if keep_first_frame:
         # save the first frame
         out_frame_file = f"{out_dir}{os.sep}{current_frame_number:08}.jpg"
-        cv2.imwrite(out_frame_file, old_frame)
+        cv2.imwrite(out_frame_file, old_frame, JPEG_PARAMS)
 
     if num_frames < -1 or num_frames > n_frames:
         print(f'The video has {n_frames} number frames in total.')
@@ -65,84 +256,101 @@ def extract_frames(video_file='None',
         if keep_first_frame:
             num_frames -= 1
 
-    hsv = np.zeros_like(old_frame)
-    hsv[..., 1] = 255
-
-    # keeped frame index
-    ki = 0
-
-    while ret:
-
-        frame_number = int(cap.get(1))
-        ret, frame = cap.read()
-
-        if num_frames == -1:
-            out_frame_file = f"{out_dir}{os.sep}{frame_number:08}.jpg"
-            if ret:
-                cv2.imwrite(
-                    out_frame_file, frame)
-                print(f'Saved the frame {frame_number}.')
-            continue
-        if algo == 'uniform':
-            if ret:
-                if len(keeped_frames) < num_frames:
-                    keeped_frames.append((ki,
-                                          frame_number,
-                                          frame))
-                else:
-                    j = random.randrange(ki + 1)
-                    if j < num_frames:
-                        keeped_frames[j] = ((j,
-                                             frame_number,
-                                             frame))
-                ki += 1
-            continue
-        if algo == 'flow' and num_frames != -1:
-            mask = subtractor.apply(frame)
-            old_mask = subtractor.apply(old_frame)
-
-            out_frame = cv2.bitwise_and(frame, frame, mask=mask)
-            old_out_frame = cv2.bitwise_and(
-                old_frame, old_frame, mask=old_mask)
-            try:
-                out_frame = cv2.cvtColor(out_frame, cv2.COLOR_BGR2GRAY)
-                old_out_frame = cv2.cvtColor(old_out_frame, cv2.COLOR_BGR2GRAY)
-
-                flow = cv2.calcOpticalFlowFarneback(
-                    old_out_frame, out_frame, None, 0.5, 3, 15, 3, 5, 1.2, 0)
-
-                if show_flow:
-                    mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
-                    hsv[..., 0] = ang*180/np.pi/2
-                    hsv[..., 2] = cv2.normalize(
-                        mag, None, 0, 255, cv2.NORM_MINMAX)
-                    rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-
-                q_score = int(np.abs(np.sum(flow.reshape(-1))))
-                print(
-                    f"precessing frame {frame_number}, the difference between previous frame is {q_score}.")
-
-                if len(keeped_frames) < num_frames:
-                    heapq.heappush(
-                        keeped_frames, ((q_score, frame_number, frame)))
-                else:
-                    heapq.heappushpop(
-                        keeped_frames, ((q_score, frame_number, frame)))
-
-                if show_flow:
-                    cv2.imshow("Frame", rgb)
-            except:
-                print('skipping the current frame.')
-
-            old_frame = frame
-
-        key = cv2.waitKey(1)
-        if key == 27:
-            break
-
-    for kf in keeped_frames:
-        s, f, p = kf
-        cv2.imwrite(f"{out_dir}{os.sep}{f:08}_{s}.jpg", p)
+    if algo == 'flow':
+        # all the per frame buffers have a fixed shape,
+        # allocate them once and reuse them in the loop
+        small = cv2.resize(old_frame, (0, 0), fx=0.25, fy=0.25)
+        small_size = (small.shape[1], small.shape[0])
+        small_gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        mask = np.empty_like(small_gray)
+        # train the background model with the first frame
+        subtractor(small_gray, mask)
+        if show_flow:
+            old_gray = cv2.cvtColor(old_frame, cv2.COLOR_BGR2GRAY)
+            gray = np.empty_like(old_gray)
+            flow = np.zeros(old_gray.shape + (2,), np.float32)
+            hsv = np.zeros_like(old_frame)
+            hsv[..., 1] = 255
+
+    # encode and write the images in the background
+    # so that decoding does not wait for the disk,
+    # with a bounded number of frames waiting to be written
+    workers = os.cpu_count()
+    max_pending = 2 * workers
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if algo == 'uniform' and num_frames != -1:
+            # decode only the randomly selected frames
+            # instead of reading through the whole video
+            frame_numbers = sorted(random.sample(range(1, n_frames),
+                                                 min(num_frames, n_frames - 1)))
+            n_saved = 0
+            for s, (f, p) in enumerate(_load_frames(video_file, frame_numbers)):
+                _submit_write(pool, pending,
+                              f"{out_dir}{os.sep}{f:08}_{s}.jpg", p,
+                              max_pending)
+                n_saved += 1
+            if n_saved < len(frame_numbers):
+                print(f'Warning: only {n_saved} of the {len(frame_numbers)} '
+                      'selected frames could be decoded, the video has '
+                      f'fewer frames than the {n_frames} it reports.')
+        else:
+            for frame_number, frame in _read_frames(cap):
+
+                if num_frames == -1:
+                    out_frame_file = f"{out_dir}{os.sep}{frame_number:08}.jpg"
+                    _submit_write(pool, pending,
+                                  out_frame_file, frame, max_pending)
+                    print(f'Saved the frame {frame_number}.')
+                    continue
+                if algo == 'flow' and num_frames != -1:
+                    try:
+                        cv2.resize(frame, small_size, dst=small)
+                        cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=small_gray)
+                        # the number of foreground pixels tells how much
+                        # the current frame moved away from the background
+                        subtractor(small_gray, mask)
+                        q_score = cv2.countNonZero(mask)
+
+                        if show_flow:
+                            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+                            # warm start from the flow of the previous frame pair
+                            cv2.calcOpticalFlowFarneback(
+                                old_gray, gray, flow, 0.5, 3, 15, 3, 5, 1.2,
+                                cv2.OPTFLOW_USE_INITIAL_FLOW)
+                            rgb = _render_flow_hsv(flow, hsv)
+                            old_gray, gray = gray, old_gray
+
+                        print(
+                            f"precessing frame {frame_number}, the number of foreground pixels is {q_score}.")
+
+                        # only keep the scores and frame numbers,
+                        # the selected frames are decoded again at the end
+                        if len(keeped_frames) < num_frames:
+                            heapq.heappush(
+                                keeped_frames, (q_score, frame_number))
+                        else:
+                            heapq.heappushpop(
+                                keeped_frames, (q_score, frame_number))
+
+                        if show_flow:
+                            cv2.imshow("Frame", rgb)
+                    except:
+                        print('skipping the current frame.')
+
+                key = cv2.waitKey(1)
+                if key == 27:
+                    break
+
+            scores = {f: s for s, f in keeped_frames}
+            for f, p in _load_frames(video_file, sorted(scores)):
+                _submit_write(pool, pending,
+                              f"{out_dir}{os.sep}{f:08}_{scores[f]}.jpg", p,
+                              max_pending)
+
+        while pending:
+            _wait_write(pending.popleft())
 
     cap.release()
     cv2.destroyAllWindows()
@@ -193,12 +401,13 @@ def track(video_file=None,
         ret, prev_frame = cap.read()
         deep_sort = build_tracker()
 
-        while ret:
-            ret, frame = cap.read()
-            if not ret:
-                print("Finished tracking.")
-                break
-            im = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # decode the next frames while the current one
+        # goes through the detector and the tracker
+        for _, frame in _read_frames(cap):
+            # the detector and the feature extractor both convert
+            # their input to float, so a channel reversed view is
+            # enough and saves a full frame copy
+            im = frame[..., ::-1]
             bbox_xywh, cls_conf, cls_ids = detector(im)
             bbox_xywh[:, 3:] *= 1.2
             mask = cls_ids == 0
@@ -223,6 +432,8 @@ def track(video_file=None,
                 break
 
             prev_frame = frame
+        else:
+            print("Finished tracking.")
 
         cv2.destroyAllWindows()
         cap.release()
@@ -1,6 +1,11 @@
 import cv2
 import numpy as np
 
+# offloading the per frame filters to an OpenCL device through
+# OpenCV's transparent API only pays off for frames larger than
+# about 512x512, below that the upload and download dominate
+MIN_OPENCL_PIXELS = 512 * 512
+
 
 class InRange():
     """
@@ -29,6 +34,9 @@ class InRange():
         self.location_history = []
         self.area_history = []
 
+        # None decides from the size of the first frame
+        self.use_opencl = None
+
     def trackbar_on_low_h_event(self, value):
         self.low_h = value
         self.low_h = min(self.high_h - 1, self.low_h)
@@ -83,6 +91,12 @@ class InRange():
             self.high_v
         )
 
+    @staticmethod
+    def _centroid(M):
+        if M['m00'] != 0:
+            return [int(M['m10'] / M['m00']), int(M['m01'] / M['m00'])]
+        return [0, 0]
+
     def detect_contours(self,
                         frame,
                         threshold,
@@ -118,31 +132,25 @@ class InRange():
             img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
         else:
 
-            contours, hierarchy = cv2.findContours(threshold.copy(),
+            # OpenCV 4 does not modify the source image,
+            # so there is no need to pass a copy
+            contours, hierarchy = cv2.findContours(threshold,
                                                    cv2.RETR_TREE,
                                                    cv2.CHAIN_APPROX_SIMPLE)
 
-        out = frame.copy()
+        # nothing is drawn on the frame, return it without a copy
+        out = frame
 
-        i = 0
-        current_location = []
-        areas = []
-
-        while i < len(contours):
-            area = cv2.contourArea(contours[i])
-            if area < min_area or area > max_area:
-                del contours[i]
-            else:
-
-                M = cv2.moments(contours[i])
-                if M['m00'] != 0:
-                    cx = int(M['m10'] / M['m00'])
-                    cy = int(M['m01'] / M['m00'])
-                else:
-                    cx, cy = 0, 0
-                current_location.append([cx, cy])
-                areas.append(area)
-                i += 1
+        # filter in one pass instead of deleting from the list,
+        # which shifts the remaining contours on every delete
+        areas_all = [cv2.contourArea(c) for c in contours]
+        kept = [(contour, area)
+                for contour, area in zip(contours, areas_all)
+                if min_area <= area <= max_area]
+        contours = [contour for contour, _ in kept]
+        areas = [area for _, area in kept]
+        current_location = [self._centroid(cv2.moments(contour))
+                            for contour in contours]
 
         return out, contours, current_location, areas
 
@@ -200,35 +208,52 @@ class InRange():
                            self.max_value,
                            self.trackbar_on_high_v_event)
 
+        kernel = np.ones((5, 5), np.uint8)
+        # the outputs of the previous frame are passed as
+        # destination buffers so they are allocated only once
+        frame = blur = gray_img = th3 = None
+        frame_HSV = in_range = frame_threshold = None
+        use_opencl = self.use_opencl
+
         while True:
-            ret, frame = cap.read()
-            if frame is None:
+            ret, frame = cap.read(frame)
+            if not ret:
                 break
-            blur = cv2.GaussianBlur(frame, (5, 5), 0)
-            gray_img = cv2.cvtColor(blur, cv2.COLOR_BGR2GRAY)
+            if use_opencl is None:
+                # useOpenCL is False without a device and when OpenCL
+                # is disabled, e.g. with OPENCV_OPENCL_DEVICE=disabled
+                use_opencl = (cv2.ocl.useOpenCL() and
+                              frame.shape[0] * frame.shape[1] >= MIN_OPENCL_PIXELS)
+            src = cv2.UMat(frame) if use_opencl else frame
+            blur = cv2.GaussianBlur(src, (5, 5), 0, dst=blur)
+            gray_img = cv2.cvtColor(blur, cv2.COLOR_BGR2GRAY, dst=gray_img)
             ret3, th3 = cv2.threshold(gray_img,
                                       0, 255,
-                                      cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-            frame_combined = cv2.bitwise_and(frame, frame, mask=th3)
-            frame_HSV = cv2.cvtColor(frame_combined, cv2.COLOR_BGR2HSV)
-            frame_threshold = cv2.inRange(
+                                      cv2.THRESH_BINARY+cv2.THRESH_OTSU,
+                                      dst=th3)
+            frame_HSV = cv2.cvtColor(src, cv2.COLOR_BGR2HSV, dst=frame_HSV)
+            in_range = cv2.inRange(
                 frame_HSV, (self.low_h, self.low_s, self.low_v),
-                (self.high_h, self.high_s, self.high_v))
-            kernel = np.ones((5, 5), np.uint8)
+                (self.high_h, self.high_s, self.high_v), dst=in_range)
+            # keep the pixels in the Otsu foreground by combining
+            # the two 1-channel masks instead of masking the color frame
+            cv2.bitwise_and(in_range, th3, dst=in_range)
             frame_threshold = cv2.morphologyEx(
-                frame_threshold, cv2.MORPH_OPEN, kernel)
-
-            frame_threshold, contours, current_location, areas = self.detect_contours(frame_threshold,
-                                                                                      frame_threshold,
-                                                                                      min_area,
-                                                                                      max_area,
-                                                                                      draw=True
-                                                                                      )
+                in_range, cv2.MORPH_OPEN, kernel, dst=frame_threshold)
+
+            # contours are found on the host
+            mask = frame_threshold.get() if use_opencl else frame_threshold
+            mask, contours, current_location, areas = self.detect_contours(mask,
+                                                                           mask,
+                                                                           min_area,
+                                                                           max_area,
+                                                                           draw=True
+                                                                           )
             if current_location and areas:
                 self.location_history.append(current_location)
                 self.area_history.append(areas)
-            frame_combined = cv2.bitwise_and(
-                frame_combined, frame_combined, mask=frame_threshold)
+            # masked copy, zero where the mask is not set
+            frame_combined = cv2.copyTo(src, frame_threshold)
 
             if draw_history:
                 frame_combined = self.draw_contour_history(
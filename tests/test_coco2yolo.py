@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+import unittest
+from annolid.annotation.coco2yolo import xywh2cxcywh, create_dataset
+
+
+class TestCoco2Yolo(unittest.TestCase):
+
+    def setUp(self):
+        self.boxes = [[10, 20, 30, 40], [0, 0, 64, 48], [5.5, 7, 1, 3]]
+        self.img_size = (64, 48)
+
+    def test_single_box(self):
+        x, y, w, h = xywh2cxcywh(self.boxes[0], self.img_size)
+        self.assertAlmostEqual(x, 25 / 64)
+        self.assertAlmostEqual(y, 40 / 48)
+        self.assertAlmostEqual(w, 30 / 64)
+        self.assertAlmostEqual(h, 40 / 48)
+
+    def test_batch_matches_single_boxes(self):
+        batch = xywh2cxcywh(self.boxes, self.img_size)
+        for i, box in enumerate(self.boxes):
+            single = xywh2cxcywh(box, self.img_size)
+            self.assertEqual([b[i] for b in batch], list(single))
+
+    def test_create_dataset_labels(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            open(os.path.join(tmp_dir, "a.jpg"), "w").close()
+            open(os.path.join(tmp_dir, "b.jpg"), "w").close()
+            data = {
+                "images": [
+                    {"file_name": "a.jpg", "width": 64, "height": 48, "id": 1},
+                    {"file_name": "b.jpg", "width": 64, "height": 48, "id": 2}
+                ],
+                "annotations": [
+                    {"image_id": 1, "category_id": 1, "bbox": self.boxes[0]},
+                    {"image_id": 1, "category_id": 2, "bbox": self.boxes[1]}
+                ],
+                "categories": [{"id": 0, "name": "background"},
+                               {"id": 1, "name": "mouse"}]
+            }
+            json_file = os.path.join(tmp_dir, "annotations.json")
+            with open(json_file, "w") as jf:
+                json.dump(data, jf)
+
+            results_dir = os.path.join(tmp_dir, "yolo")
+            names = create_dataset(json_file, results_dir=results_dir)
+            self.assertEqual(names, ["mouse"])
+
+            labels_dir = os.path.join(results_dir, "labels", "train")
+            with open(os.path.join(labels_dir, "a.txt")) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(lines[1], "2 0.5 0.5 1.0 1.0")
+            with open(os.path.join(labels_dir, "b.txt")) as f:
+                self.assertEqual(f.read(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import cv2
+import numpy as np
+from annolid.segmentation.threshold import InRange
+
+
+class TestDetectContours(unittest.TestCase):
+
+    def setUp(self):
+        self.ir = InRange()
+        self.mask = np.zeros((100, 100), np.uint8)
+        # a small and a large square
+        cv2.rectangle(self.mask, (5, 5), (9, 9), 255, -1)
+        cv2.rectangle(self.mask, (40, 40), (79, 79), 255, -1)
+
+    def test_area_filter_drops_contour(self):
+        out, contours, locations, areas = self.ir.detect_contours(
+            self.mask, self.mask, min_area=100, max_area=10000)
+        self.assertEqual(len(contours), 1)
+        self.assertEqual(areas, [39.0 * 39.0])
+        self.assertEqual(locations, [[59, 59]])
+
+    def test_keeps_contours_in_range(self):
+        out, contours, locations, areas = self.ir.detect_contours(
+            self.mask, self.mask, min_area=0, max_area=10000)
+        self.assertEqual(sorted(areas), [16.0, 39.0 * 39.0])
+        self.assertEqual(len(locations), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
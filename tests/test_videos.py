@@ -0,0 +1,70 @@
+import os
+import tempfile
+import threading
+import unittest
+import cv2
+import numpy as np
+from annolid.data.videos import _read_frames
+
+
+class BrokenCapture():
+    """A capture that fails after reading two frames."""
+
+    def __init__(self):
+        self.frame_number = 0
+
+    def get(self, prop):
+        return self.frame_number
+
+    def read(self):
+        if self.frame_number == 2:
+            raise RuntimeError("broken video")
+        self.frame_number += 1
+        return True, np.zeros((8, 8, 3), np.uint8)
+
+
+class TestReadFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.video_file = os.path.join(self.tmp_dir.name, "test.avi")
+        self.n_frames = 10
+        writer = cv2.VideoWriter(self.video_file,
+                                 cv2.VideoWriter_fourcc(*"MJPG"),
+                                 10, (64, 48))
+        for i in range(self.n_frames):
+            frame = np.full((48, 64, 3), i * 20, np.uint8)
+            writer.write(frame)
+        writer.release()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reads_all_frames(self):
+        cap = cv2.VideoCapture(self.video_file)
+        frame_numbers = [frame_number
+                         for frame_number, frame in _read_frames(cap)]
+        cap.release()
+        self.assertEqual(frame_numbers, list(range(self.n_frames)))
+
+    def test_early_break_joins_decoder(self):
+        threads = threading.active_count()
+        cap = cv2.VideoCapture(self.video_file)
+        frames = _read_frames(cap, maxsize=1)
+        for frame_number, frame in frames:
+            if frame_number == 2:
+                break
+        frames.close()
+        cap.release()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_decoder_error_is_raised(self):
+        frames = _read_frames(BrokenCapture())
+        self.assertEqual(next(frames)[0], 0)
+        self.assertEqual(next(frames)[0], 1)
+        with self.assertRaises(RuntimeError):
+            next(frames)
+
+
+if __name__ == "__main__":
+    unittest.main()